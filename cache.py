@@ -0,0 +1,124 @@
+# cache.py
+import hashlib
+import hmac
+import os
+from datetime import datetime
+
+import orjson
+import redis.asyncio as redis
+
+from time_utils import now_utc
+
+# ------------------ Redis Connection ------------------
+# Optional: without REDIS_URL every lookup falls through to MongoDB.
+REDIS_URL = os.environ.get("REDIS_URL")
+
+redis_client = redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+SESSION_FIELDS = ("name", "email", "role")
+# Cached sessions live a few minutes at most, so MongoDB stays authoritative:
+# a missed invalidation or a stale miss-path write heals within this window
+SESSION_CACHE_TTL = 300
+
+# ------------------ Session Cache ------------------
+def _session_key(token: str) -> str:
+    return f"sess:{token}"
+
+def _user_sessions_key(email: str) -> str:
+    return f"user:{email}:sessions"
+
+async def get_cached_session(token: str):
+    if redis_client is None:
+        return None
+    try:
+        raw = await redis_client.get(_session_key(token))
+    except Exception as e:
+        print(f"[CACHE ERROR] get_cached_session: {e}")
+        return None
+    if not raw:
+        return None
+    data = orjson.loads(raw)
+    if datetime.fromisoformat(data.pop("expires_at")) < now_utc():
+        return None
+    return data
+
+async def cache_session(token: str, user: dict, expires_at: datetime):
+    if redis_client is None:
+        return
+    ttl = int((expires_at - now_utc()).total_seconds())
+    if ttl <= 0:
+        return
+    # The per-user token set gets the same cap as the entries it indexes
+    ttl = min(ttl, SESSION_CACHE_TTL)
+    data = {field: user[field] for field in SESSION_FIELDS}
+    # orjson serializes the datetime natively
+    data["expires_at"] = expires_at
+    user_key = _user_sessions_key(user["email"])
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.setex(_session_key(token), ttl, orjson.dumps(data))
+            # Track the user's tokens so a role change can drop them all
+            pipe.sadd(user_key, token)
+            pipe.expire(user_key, ttl)
+            await pipe.execute()
+    except Exception as e:
+        print(f"[CACHE ERROR] cache_session: {e}")
+
+async def invalidate_session(token: str) -> bool:
+    if redis_client is None:
+        return True
+    try:
+        await redis_client.delete(_session_key(token))
+        return True
+    except Exception as e:
+        print(f"[CACHE ERROR] invalidate_session: {e}")
+        return False
+
+async def invalidate_user_sessions(email: str):
+    if redis_client is None:
+        return
+    user_key = _user_sessions_key(email)
+    try:
+        tokens = await redis_client.smembers(user_key)
+        await redis_client.delete(user_key, *(_session_key(t) for t in tokens))
+    except Exception as e:
+        print(f"[CACHE ERROR] invalidate_user_sessions: {e}")
+
+# ------------------ Failed Login Cache ------------------
+# Short-lived negative cache so replayed bad credentials skip bcrypt.
+# Keys are keyed HMACs, so attempted passwords are never stored readable.
+# Needs a LOGIN_CACHE_KEY shared by all workers (so /register can clear an
+# entry another worker wrote); without one the negative cache is disabled.
+FAILED_LOGIN_TTL = 30
+_LOGIN_CACHE_KEY = os.environ.get("LOGIN_CACHE_KEY", "").encode("utf-8")
+
+_failed_login_cache = redis_client if _LOGIN_CACHE_KEY else None
+
+def _failed_login_key(email: str, password: str) -> str:
+    digest = hmac.new(_LOGIN_CACHE_KEY, f"{email}\0{password}".encode("utf-8"), hashlib.sha256)
+    return f"login_fail:{digest.hexdigest()}"
+
+async def is_recent_failed_login(email: str, password: str) -> bool:
+    if _failed_login_cache is None:
+        return False
+    try:
+        return bool(await _failed_login_cache.exists(_failed_login_key(email, password)))
+    except Exception as e:
+        print(f"[CACHE ERROR] is_recent_failed_login: {e}")
+        return False
+
+async def remember_failed_login(email: str, password: str):
+    if _failed_login_cache is None:
+        return
+    try:
+        await _failed_login_cache.setex(_failed_login_key(email, password), FAILED_LOGIN_TTL, 1)
+    except Exception as e:
+        print(f"[CACHE ERROR] remember_failed_login: {e}")
+
+async def forget_failed_login(email: str, password: str):
+    if _failed_login_cache is None:
+        return
+    try:
+        await _failed_login_cache.delete(_failed_login_key(email, password))
+    except Exception as e:
+        print(f"[CACHE ERROR] forget_failed_login: {e}")
@@ -1,7 +1,11 @@
 # database.py
-from pymongo import MongoClient
+from pymongo import ASCENDING
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson import ObjectId
+import asyncio
 import bcrypt
 import os
+import time
 import certifi
 
 from time_utils import now_utc
@@ -11,13 +15,24 @@ MONGO_URI = os.environ.get("MONGO_URI")
 if not MONGO_URI:
     raise Exception("MONGO_URI environment variable not set!")
 
-client = MongoClient(
-    MONGO_URI,
-    tls=True,
-    tlsCAFile=certifi.where()
-)
+# Small, warm pools: each new connection costs a TLS handshake to Atlas
+CLIENT_OPTIONS = {
+    "tls": True,
+    "tlsCAFile": certifi.where(),
+    "maxPoolSize": 20,
+    "minPoolSize": 5,
+    "maxIdleTimeMS": 60000,
+    "serverSelectionTimeoutMS": 3000,
+    "retryWrites": True,
+    "compressors": "zstd,zlib",
+}
 
-db = client["system_tracking_fastapi"]
+# Motor: every query is awaited, so the event loop overlaps Mongo round trips
+client = AsyncIOMotorClient(MONGO_URI, **CLIENT_OPTIONS)
+
+DB_NAME = "system_tracking_fastapi"
+
+db = client[DB_NAME]
 
 users_col = db["users"]
 systems_col = db["systems"]
@@ -26,17 +41,137 @@ logs_col = db["usage_logs"]
 contributors_col = db["contributors"]
 sessions_col = db["sessions"]
 
+# ------------------ Indexes ------------------
+# (collection, keys, options) for every lookup on the request path
+INDEXES = [
+    (sessions_col, [("session_token", ASCENDING)], {"unique": True}),
+    # TTL monitor purges sessions once expires_at has passed
+    (sessions_col, [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    (users_col, [("email", ASCENDING)], {"unique": True}),
+    (systems_col, [("ip", ASCENDING)], {"unique": True}),
+    (active_col, [("ip", ASCENDING)], {"unique": True}),
+    (active_col, [("ip", ASCENDING), ("user", ASCENDING)], {}),
+    (contributors_col, [("main_ip", ASCENDING), ("main_user", ASCENDING)], {}),
+    (contributors_col, [("main_ip", ASCENDING), ("contributor", ASCENDING)], {"unique": True}),
+    (logs_col, [("start_time", ASCENDING)], {}),
+]
+
+_indexes_ready = False
+
+async def ensure_indexes() -> bool:
+    # Called once from the app's lifespan, not at import time; True when all exist
+    global _indexes_ready
+    if _indexes_ready:
+        return True
+    ok = True
+    for col, keys, options in INDEXES:
+        # One bad index (e.g. duplicates blocking a unique one) shouldn't skip the rest
+        try:
+            await col.create_index(keys, **options)
+        except Exception as e:
+            ok = False
+            print(f"[DB ERROR] ensure_indexes {col.name} {keys}: {e}")
+    _indexes_ready = ok
+    return ok
+
+# ------------------ Writes ------------------
+async def insert_with_server_time(col, doc: dict, *time_fields: str, session=None):
+    # Upsert on a fresh _id so Mongo stamps time_fields with $currentDate
+    # instead of trusting this node's clock; unique indexes still apply.
+    return await col.update_one(
+        {"_id": ObjectId()},
+        {"$setOnInsert": doc, "$currentDate": {field: True for field in time_fields}},
+        upsert=True,
+        session=session
+    )
+
+async def claim_system(doc: dict) -> bool:
+    # Move doc["ip"] from the free pool into active_usage in one transaction,
+    # so a failed insert can never leave the system missing from both
+    async def _claim(session):
+        if not await systems_col.find_one_and_delete({"ip": doc["ip"]}, {"_id": 1}, session=session):
+            return False
+        await insert_with_server_time(active_col, doc, "start_time", session=session)
+        return True
+
+    async with await client.start_session() as session:
+        return await session.with_transaction(_claim)
+
+async def release_main_usage(ip: str, email: str):
+    # Flip main_released and write the usage log in one transaction, so a
+    # failure can't leave the record released without its log (or vice versa)
+    async def _release(session):
+        record = await active_col.find_one_and_update(
+            {"ip": ip, "user": email, "main_released": {"$ne": True}},
+            {"$set": {"main_released": True}},
+            projection={"_id": 0, "project": 1, "duration": 1, "start_time": 1},
+            session=session
+        )
+        if not record:
+            return None
+        await insert_with_server_time(logs_col, {
+            "ip": ip,
+            "user": email,
+            "project": record["project"],
+            "duration": record["duration"],
+            "start_time": record["start_time"],
+            "is_contribution": False
+        }, "end_time", session=session)
+        return record
+
+    async with await client.start_session() as session:
+        return await session.with_transaction(_release)
+
+# ------------------ Password Hashing ------------------
+# bcrypt>=4 ships a Rust blowfish core with the same API. BCRYPT_COST pins the
+# work factor. BCRYPT_COST=auto calibrates it at import to ~250 ms/hash on this
+# machine; it is meant for picking a value to then pin as a fixed BCRYPT_COST.
+# Calibrated costs differ per instance, so they never trigger re-hashing.
+BCRYPT_TARGET_MS = 250
+
+def calibrate_bcrypt_cost(target_ms: int = BCRYPT_TARGET_MS) -> int:
+    cost = 10
+    while cost < 16:
+        start = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds=cost))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # Each extra round doubles the work
+        if elapsed_ms * 2 > target_ms:
+            break
+        cost += 1
+    return cost
+
+_cost_setting = os.environ.get("BCRYPT_COST", "12")
+if _cost_setting == "auto":
+    BCRYPT_COST = calibrate_bcrypt_cost()
+    # Re-hash target only comes from a pinned cost, never a per-process guess
+    REHASH_COST = None
+    print(f"[BCRYPT] calibrated cost {BCRYPT_COST}; set BCRYPT_COST={BCRYPT_COST} to pin it")
+else:
+    BCRYPT_COST = int(_cost_setting)
+    REHASH_COST = BCRYPT_COST
+
 # ------------------ Helper Functions ------------------
 def hash_password(password: str) -> bytes:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_COST))
 
 def check_password(password: str, hashed: bytes) -> bool:
     return bcrypt.checkpw(password.encode("utf-8"), hashed)
 
-def create_user(name: str, email: str, password: str, role="user"):
-    hashed = hash_password(password)
+def needs_rehash(hashed: bytes) -> bool:
+    if REHASH_COST is None:
+        return False
+    # Cost is the two digits in the "$2b$12$" prefix
     try:
-        users_col.insert_one({
+        return int(hashed[4:6]) < REHASH_COST
+    except ValueError:
+        return False
+
+async def create_user(name: str, email: str, password: str, role="user"):
+    # bcrypt runs off the event loop so concurrent signups use separate cores
+    hashed = await asyncio.to_thread(hash_password, password)
+    try:
+        await users_col.insert_one({
             "name": name,
             "email": email,
             "password": hashed,
@@ -48,17 +183,25 @@ def create_user(name: str, email: str, password: str, role="user"):
         print(f"[DB ERROR] create_user: {e}")
         return False
 
-def user_exists(email: str) -> bool:
+async def user_exists(email: str) -> bool:
     try:
-        return users_col.find_one({"email": email}) is not None
+        return await users_col.find_one({"email": email}, {"_id": 1}) is not None
     except Exception as e:
         print(f"[DB ERROR] user_exists: {e}")
         return False
 
-def login_user(email: str, password: str):
+async def login_user(email: str, password: str):
+    # None means unknown email or wrong password; DB/hashing errors propagate
+    # so callers can tell an outage apart from bad credentials
     try:
-        user = users_col.find_one({"email": email})
-        if user and check_password(password, user["password"]):
+        user = await users_col.find_one(
+            {"email": email}, {"_id": 0, "name": 1, "email": 1, "role": 1, "password": 1}
+        )
+        if user and await asyncio.to_thread(check_password, password, user["password"]):
+            # Lazily upgrade hashes made under an older, lower pinned BCRYPT_COST
+            if needs_rehash(user["password"]):
+                new_hash = await asyncio.to_thread(hash_password, password)
+                await users_col.update_one({"email": email}, {"$set": {"password": new_hash}})
             return {
                 "name": user["name"],
                 "email": user["email"],
@@ -66,5 +209,5 @@ def login_user(email: str, password: str):
             }
     except Exception as e:
         print(f"[DB ERROR] login_user: {e}")
+        raise
     return None
-
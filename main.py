@@ -4,44 +4,83 @@ from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse, Response as FastAPIResponse
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import timedelta
-from time_utils import now_utc, utc_to_ist
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from ipaddress import IPv4Address
+from time_utils import now_utc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import secrets
+import json
 import re
 import asyncio
+import os
 
 from database import (
     users_col, systems_col, active_col,
     logs_col, contributors_col, sessions_col,
-    create_user, user_exists, login_user
+    create_user, user_exists, login_user,
+    insert_with_server_time, claim_system, release_main_usage, ensure_indexes
+)
+from cache import (
+    get_cached_session, cache_session,
+    invalidate_session, invalidate_user_sessions, SESSION_CACHE_TTL,
+    is_recent_failed_login, remember_failed_login, forget_failed_login
 )
-
-app = FastAPI()
 
 templates = Jinja2Templates(directory="templates")
+# Templates only change on deploy: skip per-render mtime checks
+templates.env.auto_reload = False
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # bcrypt work is offloaded with asyncio.to_thread; size the pool to the cores
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=os.cpu_count())
+    )
+    # Compile every template once so requests only ever render
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
+    # Index creation runs in the background so startup doesn't wait on Atlas;
+    # ensure_indexes() also logs each failing index as it happens
+    index_task = asyncio.create_task(ensure_indexes())
+    yield
+    if not index_task.done():
+        print("[DB ERROR] ensure_indexes still running at shutdown; indexes may be missing")
+        index_task.cancel()
+    elif index_task.cancelled() or index_task.exception() or not index_task.result():
+        print("[DB ERROR] ensure_indexes did not create every index; see errors above")
+
+
+app = FastAPI(lifespan=lifespan)
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 COOKIE_NAME = "auth_session"
-from fastapi.middleware.cors import CORSMiddleware
+
+# Comma-separated list of trusted cross-origin frontends; the app itself is same-origin
+ALLOWED_ORIGINS = [o.strip() for o in os.environ.get("ALLOWED_ORIGINS", "").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+
+@lru_cache(maxsize=1024)
 def validate_ip(ip: str) -> bool:
-    parts = ip.split(".")
-    if len(parts) != 4:
-        return False
     try:
-        return all(0 <= int(p) <= 255 for p in parts)
+        IPv4Address(ip)
+        return True
     except ValueError:
         return False
 
 
+@lru_cache(maxsize=1024)
 def validate_hours(h: str):
     try:
         val = float(h)
@@ -50,22 +89,55 @@ def validate_hours(h: str):
         return None
 
 
-def get_current_user(request: Request):
+# "<ip> - free" or "<ip> - using (Owner: <email>)", as rendered in dashboard.html
+_SYSTEM_RE = re.compile(r'^(?P<ip>\d+\.\d+\.\d+\.\d+)(?: - free| - using \(Owner: (?P<owner>[^)]+)\))$')
+
+
+def parse_system(system: str):
+    # -> (ip, owner_email), owner_email None for a free system; None if malformed
+    m = _SYSTEM_RE.match(system)
+    if not m:
+        return None
+    return m["ip"], m["owner"]
+
+
+async def get_current_user(request: Request):
     token = request.cookies.get(COOKIE_NAME)
     if not token:
         return None
-    session = sessions_col.find_one({"session_token": token})
-    if not session or session["expires_at"] < now_utc():
+    cached = await get_cached_session(token)
+    if cached:
+        return cached
+    # TTL index purges expired sessions; the filter covers the sweep interval
+    session = await sessions_col.find_one(
+        {"session_token": token, "expires_at": {"$gt": now_utc()}},
+        {"_id": 0, "email": 1, "expires_at": 1}
+    )
+    if not session:
+        return None
+    user = await users_col.find_one({"email": session["email"]}, {"_id": 0, "name": 1, "email": 1, "role": 1})
+    if not user:
         return None
-    user = users_col.find_one({"email": session["email"]}, {"_id": 0, "password": 0})
-    return user if user else None
+    await cache_session(token, user, session["expires_at"])
+    return user
+
+
+# HX-Trigger skeleton per toast type; only the message is serialized per call
+_TOAST_TEMPLATES = {
+    msg_type: '{"showNotification": {"message": %s, "type": "' + msg_type + '"}}'
+    for msg_type in ("success", "error")
+}
 
 
 def htmx_toast_response(message: str, msg_type: str = "success"):
-    safe_message = re.sub(r'[^\x00-\x7F]+', '', message)
-    headers = {
-        "HX-Trigger": f'{{"showNotification": {{"message": "{safe_message}", "type": "{msg_type}"}}}}'
-    }
+    # json.dumps escapes non-ASCII as \uXXXX, keeping the header ASCII-safe
+    # without dropping characters from the message
+    template = _TOAST_TEMPLATES.get(msg_type)
+    if template:
+        trigger = template % json.dumps(message)
+    else:
+        trigger = json.dumps({"showNotification": {"message": message, "type": msg_type}})
+    headers = {"HX-Trigger": trigger}
     return FastAPIResponse(status_code=204, headers=headers)
 
 
@@ -93,24 +165,22 @@ async def register_submit(
             "error": "Name, email required; password ≥5 chars."
         })
 
-    if user_exists(email):
+    if await user_exists(email):
         return templates.TemplateResponse("register.html", {
             "request": request,
             "error": "Email already registered!"
         })
 
-    create_user(name, email, password)
+    await create_user(name, email, password)
+    # A failed attempt just before signing up must not block the first login
+    await forget_failed_login(email, password)
 
-    response = templates.TemplateResponse("register.html", {
+    # register.html redirects to /login itself once the success message shows
+    return templates.TemplateResponse("register.html", {
         "request": request,
         "success": f"Account Created Successfully!"
     })
 
-    await asyncio.sleep(1)
-
-    response.headers["HX-Redirect"] = "/login?message=Account created! Please log in.&msg_type=success"
-    return response
-
 
 @app.get("/login")
 async def login_page(request: Request):
@@ -124,27 +194,47 @@ async def login_submit(
     email: str = Form(...),
     password: str = Form(...)
 ):
-    user = login_user(email, password)
+    user = None
+    if not await is_recent_failed_login(email, password):
+        try:
+            user = await login_user(email, password)
+        except Exception:
+            # An outage is not a wrong password: don't negative-cache it
+            return templates.TemplateResponse("login.html", {
+                "request": request,
+                "error": "Login is temporarily unavailable. Please try again."
+            })
+        if not user:
+            await remember_failed_login(email, password)
     if not user:
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Invalid email or password."
         })
 
-    session_token = secrets.token_urlsafe(64)
-    client_ip = request.headers.get("X-Forwarded-For", request.client.host).split(",")[0].strip()
+    session_token = secrets.token_urlsafe(32)
+    now = now_utc()
+    expires_at = now + timedelta(days=7)
+    xff = request.headers.get("X-Forwarded-For")
+    client_ip = xff.partition(",")[0].strip() if xff else request.client.host
 
-    sessions_col.update_one(
+    previous = await sessions_col.find_one_and_update(
         {"email": user["email"]},
         {"$set": {
             "session_token": session_token,
             "email": user["email"],
             "client_ip": client_ip,
-            "created_at": now_utc(),
-            "expires_at": now_utc() + timedelta(days=7),
+            "created_at": now,
+            "expires_at": expires_at,
         }},
+        projection={"_id": 0, "session_token": 1},
         upsert=True
     )
+    if previous:
+        # One session per user: the replaced token must not stay cached
+        await invalidate_session(previous["session_token"])
+    # Write-through so the first dashboard load is already a cache hit
+    await cache_session(session_token, user, expires_at)
 
     resp = RedirectResponse("/dashboard", 302)
     resp.set_cookie(COOKIE_NAME, session_token, httponly=True, max_age=86400, path="/", samesite="lax")
@@ -156,35 +246,72 @@ async def dashboard(request: Request, user=Depends(get_current_user)):
     if not user:
         return RedirectResponse("/login")
 
-    systems = list(systems_col.find({}, {"_id": 0}))
-    active_records = list(active_col.find({}, {"_id": 0}))
-
-    active = []
-    for a in active_records:
-        # Resolve owner name for display
-        owner = users_col.find_one({"email": a["user"]}, {"name": 1})
-        a["owner_name"] = owner["name"] if owner else a["user"]
-
-        contribs = list(contributors_col.find({"main_ip": a["ip"], "main_user": a["user"]}, {"_id": 0}))
-        for c in contribs:
-            c_user = users_col.find_one({"email": c["contributor"]}, {"name": 1})
-            c["contributor_name"] = c_user["name"] if c_user else c["contributor"]
-        a["contributors"] = contribs
-        active.append(a)
-
-    now = now_utc()
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-    logs = list(logs_col.find({"start_time": {"$gte": today_start, "$lte": today_end}}, {"_id": 0}))
-
-    normal_users = [u["name"] for u in users_col.find({"role": {"$in": ["user", "assigner"]}}, {"_id": 0, "name": 1})]
-    all_users = list(users_col.find({"role": "user"}, {"_id": 0, "email": 1, "name": 1}))
+    today_start = datetime.combine(now_utc().date(), time.min)
+    today_end = today_start + timedelta(days=1)
+
+    # Join each active record with its owner's name and its contributors
+    # (with their names) in a single round trip
+    active_pipeline = [
+        {"$lookup": {
+            "from": users_col.name,
+            "localField": "user",
+            "foreignField": "email",
+            "as": "owner"
+        }},
+        {"$lookup": {
+            "from": contributors_col.name,
+            "let": {"ip": "$ip", "user": "$user"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$main_ip", "$$ip"]},
+                    {"$eq": ["$main_user", "$$user"]}
+                ]}}},
+                {"$lookup": {
+                    "from": users_col.name,
+                    "localField": "contributor",
+                    "foreignField": "email",
+                    "as": "contributor_user"
+                }},
+                {"$project": {
+                    "_id": 0, "main_ip": 1, "contributor": 1, "project": 1, "duration": 1,
+                    "contributor_name": {"$ifNull": [{"$arrayElemAt": ["$contributor_user.name", 0]}, "$contributor"]}
+                }}
+            ],
+            "as": "contributors"
+        }},
+        {"$project": {
+            "_id": 0, "ip": 1, "user": 1, "project": 1, "duration": 1,
+            "start_time": 1, "main_released": 1, "contributors": 1,
+            "owner_name": {"$ifNull": [{"$arrayElemAt": ["$owner.name", 0]}, "$user"]}
+        }}
+    ]
+
+    # Independent reads: overlap their round trips. Larger first batches
+    # let small collections arrive without extra getMore round trips.
+    systems, active, logs, users = await asyncio.gather(
+        systems_col.find({}, {"_id": 0, "ip": 1}).batch_size(500).to_list(None),
+        active_col.aggregate(active_pipeline, batchSize=500).to_list(None),
+        logs_col.find(
+            {"start_time": {"$gte": today_start, "$lt": today_end}},
+            {"_id": 0, "ip": 1, "user": 1, "project": 1, "duration": 1,
+             "start_time": 1, "end_time": 1, "is_contribution": 1}
+        ).batch_size(500).to_list(None),
+        # Both user lists come back shaped by the server in a single document
+        users_col.aggregate([
+            {"$match": {"role": {"$in": ["user", "assigner"]}}},
+            {"$facet": {
+                "normal_users": [{"$project": {"_id": 0, "name": 1}}],
+                "all_users": [
+                    {"$match": {"role": "user"}},
+                    {"$project": {"_id": 0, "email": 1, "name": 1}}
+                ]
+            }}
+        ]).to_list(None),
+    )
 
-    all_systems = []
-    for s in systems:
-        all_systems.append({"ip": s["ip"], "status": "free"})
-    for a in active:
-        all_systems.append({"ip": a["ip"], "status": "used", "owner": a["user"]})
+    users = users[0]
+    normal_users = [u["name"] for u in users["normal_users"]]
+    all_users = users["all_users"]
 
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
@@ -193,10 +320,7 @@ async def dashboard(request: Request, user=Depends(get_current_user)):
         "active": active,
         "logs": logs,
         "normal_users": normal_users,
-        "all_systems": all_systems,
-        "all_users": all_users,
-        "is_manager": user["role"] == "manager",
-        "is_assigner": user["role"] == "assigner"
+        "all_users": all_users
     })
 
 
@@ -204,7 +328,12 @@ async def dashboard(request: Request, user=Depends(get_current_user)):
 async def logout(request: Request):
     token = request.cookies.get(COOKIE_NAME)
     if token:
-        sessions_col.delete_one({"session_token": token})
+        _, invalidated = await asyncio.gather(
+            sessions_col.delete_one({"session_token": token}),
+            invalidate_session(token)
+        )
+        if not invalidated:
+            print(f"[CACHE ERROR] logout: cached session still valid for up to {SESSION_CACHE_TTL}s")
     resp = RedirectResponse("/login")
     resp.delete_cookie(COOKIE_NAME, path="/")
     return resp
@@ -213,21 +342,22 @@ async def logout(request: Request):
 # ===== HTMX Endpoints =====
 @app.post("/book")
 async def book_system(request: Request, ip: str = Form(...), project: str = Form(...), duration: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         return htmx_toast_response("Please log in first.", "error")
     if not project.strip() or validate_hours(duration) is None:
         return htmx_toast_response("Project and valid duration required.", "error")
     try:
-        systems_col.delete_one({"ip": ip})
-        active_col.insert_one({
+        # Only one concurrent booking can claim the free system
+        claimed = await claim_system({
             "ip": ip,
             "user": user["email"],  # ✅ store email
             "project": project,
             "duration": duration,
-            "start_time": now_utc(),
             "main_released": False
         })
+        if not claimed:
+            return htmx_toast_response(f"{ip} is already booked.", "error")
         return htmx_toast_response(f"{ip} booked successfully!", "success")
     except Exception as e:
         print(f"Error in /book: {e}")
@@ -242,48 +372,46 @@ async def assign_system(
     project: str = Form(...),
     duration: str = Form(...)
 ):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user or user["role"] not in ["manager", "assigner"]:
         return htmx_toast_response("Access denied. Only managers or assigners can assign systems.", "error")
     if not project.strip() or validate_hours(duration) is None:
         return htmx_toast_response("Invalid project or duration.", "error")
 
     # ✅ Validate target user exists and is a normal user
-    assigned_user = users_col.find_one({"email": user_email, "role": "user"})
+    assigned_user = await users_col.find_one({"email": user_email, "role": "user"}, {"_id": 0, "name": 1})
     if not assigned_user:
         return htmx_toast_response(f"User {user_email} not found or not a normal user.", "error")
 
+    parsed = parse_system(system)
+    if not parsed:
+        return htmx_toast_response("Invalid system format.", "error")
+    ip, owner_email = parsed
+
     try:
-        if " - free" in system:
-            ip = system.replace(" - free", "")
-            systems_col.delete_one({"ip": ip})
-            active_col.insert_one({
+        if owner_email is None:
+            claimed = await claim_system({
                 "ip": ip,
                 "user": user_email,  # ✅
                 "project": project,
                 "duration": duration,
-                "start_time": now_utc(),
                 "main_released": False
             })
+            if not claimed:
+                return htmx_toast_response(f"{ip} is no longer free.", "error")
             return htmx_toast_response(f"{ip} assigned to {assigned_user['name']}.", "success")
         else:
-            if " - using (Owner: " not in system:
-                return htmx_toast_response("Invalid system format.", "error")
-            ip = system.split(" - using (Owner: ")[0]
-            owner_email = system.split("(Owner: ")[1].rstrip(")")
-
             # Optional: validate owner exists
-            if not users_col.find_one({"email": owner_email}):
+            if not await users_col.find_one({"email": owner_email}, {"_id": 1}):
                 return htmx_toast_response("Invalid owner.", "error")
 
-            contributors_col.insert_one({
+            await insert_with_server_time(contributors_col, {
                 "main_ip": ip,
                 "main_user": owner_email,    # ✅
                 "contributor": user_email,   # ✅
                 "project": project,
-                "duration": duration,
-                "start_time": now_utc()
-            })
+                "duration": duration
+            }, "start_time")
             return htmx_toast_response(f"{assigned_user['name']} added as contributor to {ip}.", "success")
     except Exception as e:
         print(f"Error in /assign: {e}")
@@ -292,7 +420,7 @@ async def assign_system(
 
 @app.post("/self/contribute")
 async def self_contribute(request: Request, system: str = Form(...), project: str = Form(...), duration: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         return htmx_toast_response("Please log in first.", "error")
 
@@ -303,25 +431,24 @@ async def self_contribute(request: Request, system: str = Form(...), project: st
         return htmx_toast_response("Project and valid duration required.", "error")
 
     try:
-        if " - using (Owner: " not in system:
+        parsed = parse_system(system)
+        if not parsed or parsed[1] is None:
             return htmx_toast_response("Invalid system format.", "error")
 
-        ip = system.split(" - using (Owner: ")[0]
-        owner_email = system.split("(Owner: ")[1].rstrip(")")
+        ip, owner_email = parsed
 
         # Prevent duplicate
-        already = contributors_col.find_one({"main_ip": ip, "contributor": user["email"]})
+        already = await contributors_col.find_one({"main_ip": ip, "contributor": user["email"]}, {"_id": 1})
         if already:
             return htmx_toast_response("You are already a contributor.", "error")
 
-        contributors_col.insert_one({
+        await insert_with_server_time(contributors_col, {
             "main_ip": ip,
             "main_user": owner_email,
             "contributor": user["email"],  # ✅ store email
             "project": project,
-            "duration": duration,
-            "start_time": now_utc()
-        })
+            "duration": duration
+        }, "start_time")
 
         return htmx_toast_response(f"Joined {ip} as contributor!", "success")
 
@@ -332,80 +459,87 @@ async def self_contribute(request: Request, system: str = Form(...), project: st
 
 @app.post("/release/main")
 async def release_main(request: Request, ip: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(403)
-    record = active_col.find_one({"ip": ip, "user": user["email"]})  # ✅ match by email
+    # The release transaction and the contributor count are independent: overlap them
+    record, contrib_count = await asyncio.gather(
+        release_main_usage(ip, user["email"]),  # ✅ match by email
+        contributors_col.count_documents({"main_ip": ip, "main_user": user["email"]})
+    )
     if not record:
-        raise HTTPException(404)
-
-    contrib_count = contributors_col.count_documents({"main_ip": ip, "main_user": user["email"]})
-    logs_col.insert_one({
-        "ip": ip,
-        "user": user["email"],  # ✅
-        "project": record["project"],
-        "duration": record["duration"],
-        "start_time": record["start_time"],
-        "end_time": now_utc(),
-        "is_contribution": False
-    })
+        # A previous attempt may have committed the release but failed before
+        # freeing the IP; let the retry finish the job instead of 404ing forever
+        stuck = contrib_count == 0 and await active_col.find_one(
+            {"ip": ip, "user": user["email"], "main_released": True}, {"_id": 1}
+        )
+        if not stuck:
+            raise HTTPException(404)
 
     if contrib_count == 0:
-        try:
-            systems_col.insert_one({"ip": ip})
-        except:
-            pass
-        active_col.delete_one({"ip": ip})
+        # Only whoever actually removes the record returns the IP to the pool
+        deleted = await active_col.delete_one({"ip": ip, "main_released": True})
+        if deleted.deleted_count:
+            try:
+                await systems_col.insert_one({"ip": ip})
+            except:
+                pass
         return htmx_toast_response(f"{ip} released.", "success")
-    else:
-        active_col.update_one({"ip": ip}, {"$set": {"main_released": True}})
-        return htmx_toast_response(f"{ip} released. Contributors remain.", "success")
+    return htmx_toast_response(f"{ip} released. Contributors remain.", "success")
 
 
 @app.post("/release/contrib")
 async def release_contrib(request: Request, main_ip: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user:
         raise HTTPException(403)
     
     # No need for 'contributor' param — use session user
-    c = contributors_col.find_one({"main_ip": main_ip, "contributor": user["email"]})  # ✅
-    if c:
-        logs_col.insert_one({
+    # Read and remove the contribution in one atomic step
+    c = await contributors_col.find_one_and_delete(
+        {"main_ip": main_ip, "contributor": user["email"]},  # ✅
+        projection={"_id": 0, "main_user": 1, "project": 1, "duration": 1, "start_time": 1}
+    )
+    if not c:
+        return htmx_toast_response(f"No contribution found for {main_ip}.", "error")
+
+    _, remaining = await asyncio.gather(
+        insert_with_server_time(logs_col, {
             "ip": main_ip,
             "user": user["email"],  # ✅
             "main_user": c["main_user"],
             "project": c["project"],
             "duration": c["duration"],
             "start_time": c["start_time"],
-            "end_time": now_utc(),
             "is_contribution": True
-        })
-        contributors_col.delete_one({"main_ip": main_ip, "contributor": user["email"]})
+        }, "end_time"),
+        contributors_col.count_documents({"main_ip": main_ip})
+    )
 
-        remaining = contributors_col.count_documents({"main_ip": main_ip})
-        main_released = active_col.find_one({"ip": main_ip, "main_released": True})
-        if remaining == 0 and main_released:
+    if remaining == 0:
+        # Retire the main record only if its owner already left; the atomic
+        # delete means exactly one concurrent releaser frees the IP
+        main_record = await active_col.find_one_and_delete(
+            {"ip": main_ip, "main_released": True}, projection={"_id": 1}
+        )
+        if main_record:
             try:
-                systems_col.insert_one({"ip": main_ip})
+                await systems_col.insert_one({"ip": main_ip})
             except:
                 pass
-            active_col.delete_one({"ip": main_ip})
             return htmx_toast_response(f"{main_ip} fully released!", "success")
-        else:
-            return htmx_toast_response(f"Contribution to {main_ip} released.", "success")
-    return htmx_toast_response(f"No contribution found for {main_ip}.", "error")
+    return htmx_toast_response(f"Contribution to {main_ip} released.", "success")
 
 
 @app.post("/add/system")
 async def add_system(request: Request, ip: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user or user["role"] not in ["manager", "assigner"]:
         return htmx_toast_response("Access denied.", "error")
     if not validate_ip(ip):
         return htmx_toast_response(f"{ip} is in Invalid format!", "error")
     try:
-        systems_col.insert_one({"ip": ip})
+        await systems_col.insert_one({"ip": ip})
         return htmx_toast_response(f"{ip} is added successfully!", "success")
     except Exception as e:
         print(e)
@@ -414,22 +548,25 @@ async def add_system(request: Request, ip: str = Form(...)):
 
 @app.post("/remove/system")
 async def remove_system(request: Request, ip: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user or user["role"] not in ["manager", "assigner"]:
         raise HTTPException(403)
-    systems_col.delete_one({"ip": ip})
-    active_col.delete_one({"ip": ip})
-    contributors_col.delete_many({"main_ip": ip})
+    await asyncio.gather(
+        systems_col.delete_one({"ip": ip}),
+        active_col.delete_one({"ip": ip}),
+        contributors_col.delete_many({"main_ip": ip})
+    )
     return htmx_toast_response(f"{ip} removed!", "success")
 
 
 @app.post("/promote")
 async def promote_user(request: Request, email: str = Form(...), role: str = Form(...)):
-    user = get_current_user(request)
+    user = await get_current_user(request)
     if not user or user["role"] != "manager":
         raise HTTPException(403)
     if role in ["manager", "assigner"]:
-        users_col.update_one({"email": email}, {"$set": {"role": role}})
+        await users_col.update_one({"email": email}, {"$set": {"role": role}})
+        await invalidate_user_sessions(email)
         return htmx_toast_response(f"{email} promoted as {role}!", "success")
     return htmx_toast_response(f"Invalid role for {email}", "error")
 